@@ -1,27 +1,79 @@
-from fastapi import FastAPI, HTTPException, Depends
-from sqlalchemy import create_engine, Column, Integer, String, Table, ForeignKey
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session, relationship
-from pydantic import BaseModel, validator
+from asyncio import current_task
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Response
+from sqlalchemy import bindparam, event, lambda_stmt, make_url, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, async_scoped_session, AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.dialects import postgresql, sqlite
+from pydantic import BaseModel, ConfigDict, Field, StringConstraints, field_validator
+from typing import Annotated
+from fastapi.responses import ORJSONResponse
+from fastapi_cache import FastAPICache
+from fastapi_cache.backends.inmemory import InMemoryBackend
+from fastapi_cache.backends.redis import RedisBackend
+from fastapi_cache.key_builder import default_key_builder
+from redis import asyncio as aioredis
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
+import hashlib
 import logging
 from dotenv import load_dotenv
 import os
 
+from models import Base, Medicine, User, user_medicine
+
 load_dotenv()  # Load environment variables from the .env file
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL is not set in the environment or .env file")
 
+REDIS_URL = os.getenv("REDIS_URL")  # Optional; response caching falls back to process memory
+
 # Setup basic logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# Cache key builder that drops a "db" kwarg. No current endpoint takes one; it only matters
+# for future @cache-decorated GETs that inject a session as a db parameter (e.g. Depends(get_db))
+def no_db_key_builder(func, namespace="", *, request=None, response=None, args=(), kwargs=None):
+    kwargs = {name: value for name, value in (kwargs or {}).items() if name != "db"}
+    return default_key_builder(func, namespace, request=request, response=response, args=args, kwargs=kwargs)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create tables and seed sample data before serving requests. Workers started together
+    # take turns under the schema lock, so only the first one creates and seeds anything.
+    async with engine.connect() as conn:
+        await lock_schema(conn)
+        await conn.run_sync(Base.metadata.create_all)
+        await init_db(conn)
+        await conn.commit()
+    # Response cache for read endpoints; decorate them with @cache(expire=60)
+    if REDIS_URL:
+        redis = aioredis.from_url(REDIS_URL)
+        FastAPICache.init(RedisBackend(redis), prefix="med", key_builder=no_db_key_builder)
+    else:
+        redis = None
+        FastAPICache.init(InMemoryBackend(), prefix="med", key_builder=no_db_key_builder)
+    yield
+    if redis is not None:
+        await redis.aclose()
+    await engine.dispose()
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# Long-lived cache headers let browsers and the CDN serve repeat hits without reaching the app.
+# No "immutable": these URLs are not fingerprinted, so browsers must still revalidate with the ETag.
+STATIC_CACHE_CONTROL = "public, max-age=86400"
+
+class CachedStaticFiles(StaticFiles):
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["cache-control"] = STATIC_CACHE_CONTROL
+        return response
+
+app.mount("/static", CachedStaticFiles(directory="static", html=False), name="static")
 
 html = """
 <!DOCTYPE html>
@@ -41,127 +93,192 @@ html = """
     </body>
 </html>
 """
+# The landing page never changes at runtime, so encode it and compute its ETag once
+html_bytes = html.encode("utf-8")
+html_etag = f'"{hashlib.md5(html_bytes).hexdigest()}"'
+html_headers = {"cache-control": STATIC_CACHE_CONTROL, "etag": html_etag}
 
 # Database configuration
-DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
-
-# Many-to-many relationship table
-user_medicine = Table(
-    "user_medicine",
-    Base.metadata,
-    Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
-    Column("medicine_id", Integer, ForeignKey("medicines.id"), primary_key=True),
+# Map plain driver URLs onto their asyncio counterparts so existing .env files keep working
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+db_url = make_url(DATABASE_URL)
+db_url = db_url.set(drivername=ASYNC_DRIVERS.get(db_url.drivername, db_url.drivername))
+
+connect_args = {}
+if db_url.drivername == "postgresql+asyncpg":
+    # asyncpg.connect() rejects libpq-only query parameters, so translate or drop them
+    query = dict(db_url.query)
+    if "sslmode" in query:
+        connect_args["ssl"] = query.pop("sslmode")  # asyncpg accepts libpq sslmode names
+    if "connect_timeout" in query:
+        connect_args["timeout"] = float(query.pop("connect_timeout"))
+    for param in ("channel_binding", "gssencmode"):
+        if query.pop(param, None) is not None:
+            logger.warning(f"Ignoring DATABASE_URL parameter {param}, which asyncpg does not support")
+    db_url = db_url.set(query=query)
+
+# Size the pool for concurrent bursts instead of the default 5 + 10
+pool_options = {"pool_size": 20, "max_overflow": 40}
+if db_url.get_backend_name() == "sqlite":
+    connect_args["check_same_thread"] = False
+    if db_url.database in (None, "", ":memory:"):
+        # In-memory databases must keep aiosqlite's default StaticPool: one shared connection
+        engine_options = {}
+    else:
+        # aiosqlite defaults file databases to NullPool, which reconnects (and re-runs the
+        # PRAGMAs) on every checkout; a local file needs no pre-ping or recycling
+        engine_options = {"poolclass": AsyncAdaptedQueuePool, **pool_options}
+else:
+    engine_options = {"pool_pre_ping": True, "pool_recycle": 3600, **pool_options}
+
+engine = create_async_engine(db_url, connect_args=connect_args, **engine_options)
+
+if engine.dialect.name == "sqlite":
+    # WAL lets readers proceed during writes and, with synchronous=NORMAL, avoids an fsync per commit
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_sqlite_pragmas(dbapi_conn, _):
+        cursor = dbapi_conn.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=134217728")
+        # Enforce user_medicine foreign keys so linking to an unknown user fails like it does on PostgreSQL
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+SessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+# One session per request task, released by SessionScopeMiddleware once the response is sent
+SessionScoped = async_scoped_session(SessionLocal, scopefunc=current_task)
+
+# Multi-row INSERT for user_medicine that skips pairs the user already has
+upsert_dialect = postgresql if engine.dialect.name == "postgresql" else sqlite
+link_medicines = upsert_dialect.insert(user_medicine).on_conflict_do_nothing()
+
+# Medicine name -> id for names found in the catalog. Unknown names are never cached, so the
+# cache is bounded by the catalog, which is seeded at startup and has no admin endpoints.
+medicine_id_cache = {}
+# Built once per process; only the expanding "names" parameter varies between calls
+medicine_ids_by_names = lambda_stmt(
+    lambda: select(Medicine.name, Medicine.id).where(Medicine.name.in_(bindparam("names", expanding=True)))
 )
 
-# Medicine model
-class Medicine(Base):
-    __tablename__ = "medicines"
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, index=True)
-    users = relationship("User", secondary=user_medicine, back_populates="medicines")
-
-# User model
-class User(Base):
-    __tablename__ = "users"
-    id = Column(Integer, primary_key=True, index=True)
-    name = Column(String, index=True)
-    medicines = relationship("Medicine", secondary=user_medicine, back_populates="users")
-
-# Create database tables
-Base.metadata.create_all(bind=engine)
-
-# Dependency to get the database session
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+async def resolve_medicine_ids(db, names):
+    uncached = [name for name in names if name not in medicine_id_cache]
+    if uncached:
+        medicine_id_cache.update((await db.execute(medicine_ids_by_names, {"names": uncached})).all())
+    return [medicine_id_cache[name] for name in names if name in medicine_id_cache]
+
+async def link_medicines_to_user(db, request):
+    """Link the requested medicines to the user in one statement and return how many were new."""
+    for can_retry in (True, False):
+        medicine_ids = await resolve_medicine_ids(db, request.medicine_names)
+        if not medicine_ids:
+            raise HTTPException(status_code=404, detail="One or more medicines not found")
+        try:
+            result = await db.execute(
+                link_medicines.values([{"user_id": request.user_id, "medicine_id": m_id} for m_id in medicine_ids])
+            )
+            await db.commit()
+            return result.rowcount
+        except IntegrityError:
+            # Either user_id is unknown or a cached medicine id no longer exists in the table
+            await db.rollback()
+            if (await db.execute(select(User.id).where(User.id == request.user_id))).first() is None:
+                raise HTTPException(status_code=404, detail="User not found")
+            if not can_retry:
+                raise
+        # The user exists, so the cached ids were stale; look the names up again
+        for name in request.medicine_names:
+            medicine_id_cache.pop(name, None)
+
+# Release the request's scoped session after the response, even if the endpoint failed
+class SessionScopeMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if scope["type"] == "http":
+                await SessionScoped.remove()
+
+app.add_middleware(SessionScopeMiddleware)
+
+MAX_MEDICINE_NAME_LENGTH = 128
 
 # Pydantic model for UserMedicineRequest
 class UserMedicineRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid", frozen=True)
+
     user_id: int
-    medicine_names: list[str]
+    # Length bounds are enforced by pydantic-core rather than a Python validator
+    medicine_names: Annotated[
+        list[Annotated[str, StringConstraints(max_length=MAX_MEDICINE_NAME_LENGTH)]],
+        Field(min_length=1, max_length=256),
+    ]
 
-    @validator("medicine_names")
-    def validate_medicine_names(cls, value):
-        if not value:
-            raise ValueError("medicine_names must not be empty")
-        return value
+    @field_validator("medicine_names", mode="after")
+    @classmethod
+    def dedupe_medicine_names(cls, value):
+        # Drop repeated names, keeping first-seen order, so lookups and IN() lists stay minimal
+        return list(dict.fromkeys(value))
+
+# Match If-None-Match like Starlette's StaticFiles: a comma-separated list of possibly
+# weak (W/"...") tags, as produced by CDNs that compress responses, or "*"
+def etag_matches(if_none_match, etag):
+    tags = [tag.strip(" W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
 
 @app.get("/")
-async def root():
-    return HTMLResponse(html)
+async def root(request: Request):
+    if etag_matches(request.headers.get("if-none-match", ""), html_etag):
+        return Response(status_code=304, headers=html_headers)
+    return Response(content=html_bytes, media_type="text/html", headers=html_headers)
 
 @app.post("/user/add_medicines")
-def add_medicines_to_user(request: UserMedicineRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == request.user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    medicines = db.query(Medicine).filter(Medicine.name.in_(request.medicine_names)).all()
-    if not medicines:
-        raise HTTPException(status_code=404, detail="One or more medicines not found")
-    
-    existing_medicines = {m.id for m in user.medicines}
-    new_medicines = [m for m in medicines if m.id not in existing_medicines]
-    
-    if new_medicines:
-        user.medicines.extend(new_medicines)
-        db.commit()
-        logger.info(f"Added medicines {', '.join([m.name for m in new_medicines])} to user {user.name}")
-    return {"user_id": user.id, "medicines": [m.name for m in user.medicines]}
+async def add_medicines_to_user(request: UserMedicineRequest):
+    async with SessionScoped() as db:
+        added = await link_medicines_to_user(db, request)
+        if added:
+            logger.info(f"Added {added} medicines to user {request.user_id}")
+        return {"user_id": request.user_id, "added": added}
 
 @app.post("/user/buy_medicines")
-def buy_medicines(request: UserMedicineRequest, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.id == request.user_id).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    medicines = db.query(Medicine).filter(Medicine.name.in_(request.medicine_names)).all()
-    if not medicines:
-        raise HTTPException(status_code=404, detail="One or more medicines not found")
-    
-    new_medicines = []
-    for medicine in medicines:
-        if medicine not in user.medicines:
-            user.medicines.append(medicine)
-            new_medicines.append(medicine)
-    
-    if new_medicines:
-        db.commit()
-        logger.info(f"User {user.name} bought medicines {', '.join([m.name for m in new_medicines])}")
-    
-    return {"user_id": user.id, "bought_medicines": [m.name for m in new_medicines]}
-
-# Initialize sample data
-def init_db():
-    db = SessionLocal()
-    if not db.query(Medicine).first():
-        medicines = [
-            Medicine(name="Paracetamol"),
-            Medicine(name="Broufen"),
-            Medicine(name="Panadol"),
-            Medicine(name="Alp"),
-            Medicine(name="Calpol"),
-        ]
-        db.add_all(medicines)
-        db.commit()
+async def buy_medicines(request: UserMedicineRequest):
+    async with SessionScoped() as db:
+        bought = await link_medicines_to_user(db, request)
+        if bought:
+            logger.info(f"User {request.user_id} bought {bought} medicines")
+        return {"user_id": request.user_id, "bought": bought}
+
+SCHEMA_LOCK_KEY = 0x6D6564  # Arbitrary application-wide key for pg_advisory_xact_lock
+
+async def lock_schema(conn):
+    """Serialize startup schema work across processes until conn's transaction ends."""
+    if engine.dialect.name == "postgresql":
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": SCHEMA_LOCK_KEY})
+    elif engine.dialect.name == "sqlite":
+        # Takes the database write lock up front; other workers wait on the busy timeout
+        await conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+SAMPLE_MEDICINES = ["Paracetamol", "Broufen", "Panadol", "Alp", "Calpol"]
+SAMPLE_USERS = ["John Doe", "Jane Smith", "Bjorn", "Ali"]
+
+# Initialize sample data; runs under the schema lock, and the unique medicine names
+# make a repeated medicine seed a no-op
+async def init_db(conn):
+    if (await conn.execute(select(Medicine.id).limit(1))).first() is None:
+        await conn.execute(
+            upsert_dialect.insert(Medicine.__table__).on_conflict_do_nothing(),
+            [{"name": name} for name in SAMPLE_MEDICINES],
+        )
         logger.info("Sample medicines added to the database.")
-    if not db.query(User).first():
-        users = [
-            User(name="John Doe"),
-            User(name="Jane Smith"),
-            User(name="Bjorn"),
-            User(name="Ali"),
-        ]
-        db.add_all(users)
-        db.commit()
+    if (await conn.execute(select(User.id).limit(1))).first() is None:
+        await conn.execute(User.__table__.insert(), [{"name": name} for name in SAMPLE_USERS])
         logger.info("Sample users added to the database.")
-    db.close()
-
-# Uncomment the following line to initialize the database (use only in development)
-init_db()
\ No newline at end of file
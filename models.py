@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Integer, String, Table, ForeignKey
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship
+
+Base = declarative_base()
+
+# Many-to-many relationship table
+user_medicine = Table(
+    "user_medicine",
+    Base.metadata,
+    Column("user_id", Integer, ForeignKey("users.id"), primary_key=True),
+    Column("medicine_id", Integer, ForeignKey("medicines.id"), primary_key=True),
+)
+
+# Medicine model
+class Medicine(Base):
+    __tablename__ = "medicines"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, index=True, unique=True)
+    users = relationship("User", secondary=user_medicine, back_populates="medicines")
+
+# User model
+class User(Base):
+    __tablename__ = "users"
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String, index=True)
+    medicines = relationship("Medicine", secondary=user_medicine, back_populates="users", lazy="selectin")